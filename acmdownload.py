@@ -1,12 +1,123 @@
 from html.parser import HTMLParser
 from bs4 import BeautifulSoup
+import argparse
 import json
 import requests
 import sqlite3
 import re
+import sys
+import time
 
 FILE_NAME = 'docs.json'
 DB_NAME = 'docs.db'
+METRICS_FILE = 'crawl-metrics.json'
+
+# Retries for failed requests, with exponential backoff starting at RETRY_DELAY seconds
+MAX_RETRIES = 3
+RETRY_DELAY = 1
+# Seconds to wait for a connection and between bytes of a response, so a stalled request is retried
+REQUEST_TIMEOUT = 30
+
+class CrawlMetrics:
+    """Latency histograms, transfer and throughput counters for a crawl"""
+
+    # Upper bounds of the latency histogram buckets, in milliseconds
+    BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+    def __init__(self):
+        self.start = time.time()
+        self.endpoints = {}
+        self.store_hits = 0
+        self.store_misses = 0
+        self.frontier = []
+
+    def endpoint(self, name):
+        if name not in self.endpoints:
+            self.endpoints[name] = {
+                'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'histogram': [0] * (len(self.BUCKETS_MS) + 1),
+            }
+        return self.endpoints[name]
+
+    def record(self, name, seconds, nbytes=0, error=False):
+        e = self.endpoint(name)
+        ms = seconds * 1000
+        e['count'] += 1
+        e['errors'] += error
+        e['bytes'] += nbytes
+        e['total_ms'] += ms
+        e['max_ms'] = max(e['max_ms'], ms)
+        bucket = 0
+        while bucket < len(self.BUCKETS_MS) and ms > self.BUCKETS_MS[bucket]:
+            bucket += 1
+        e['histogram'][bucket] += 1
+
+    def retry(self, name):
+        self.endpoint(name)['retries'] += 1
+
+    def doc_done(self, from_store, frontier_size):
+        if from_store:
+            self.store_hits += 1
+        else:
+            self.store_misses += 1
+        self.frontier.append((round(time.time() - self.start, 3), self.store_hits + self.store_misses, frontier_size))
+
+    def docs_per_second(self):
+        elapsed = time.time() - self.start
+        return (self.store_hits + self.store_misses) / elapsed if elapsed > 0 else 0.0
+
+    def progress_line(self, uid):
+        docs = self.store_hits + self.store_misses
+        nbytes = sum(e['bytes'] for e in self.endpoints.values())
+        frontier = self.frontier[-1][2] if self.frontier else 0
+        return '%d docs (%d from store), %.2f docs/s, %.1f MB, frontier %d, last %s' % (
+            docs, self.store_hits, self.docs_per_second(), nbytes / 1e6, frontier, uid)
+
+    def summary(self):
+        docs = self.store_hits + self.store_misses
+        endpoints = {}
+        for name, e in self.endpoints.items():
+            endpoints[name] = dict(e, mean_ms=e['total_ms'] / e['count'] if e['count'] else 0.0,
+                                   buckets_ms=self.BUCKETS_MS + ['inf'])
+        return {
+            'elapsed_s': time.time() - self.start,
+            'docs': docs,
+            'docs_per_second': self.docs_per_second(),
+            'store_hits': self.store_hits,
+            'store_misses': self.store_misses,
+            'store_hit_ratio': self.store_hits / docs if docs else 0.0,
+            'bytes': sum(e['bytes'] for e in self.endpoints.values()),
+            'retries': sum(e['retries'] for e in self.endpoints.values()),
+            'endpoints': endpoints,
+            # (elapsed seconds, docs done, frontier size) after each document
+            'frontier': self.frontier,
+        }
+
+    def save(self, path=METRICS_FILE):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+def fetch(method, url, endpoint, metrics=None, **kwargs):
+    """Issue a request, retrying connection errors, timeouts and 429/5xx responses, and record it in metrics"""
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            r = requests.request(method, url, **kwargs)
+        except requests.RequestException:
+            if metrics:
+                metrics.record(endpoint, time.perf_counter() - start, error=True)
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            failed = r.status_code == 429 or r.status_code >= 500
+            if metrics:
+                metrics.record(endpoint, time.perf_counter() - start, len(r.content), error=failed)
+            if not failed or attempt == MAX_RETRIES:
+                return r
+        if metrics:
+            metrics.retry(endpoint)
+        time.sleep(RETRY_DELAY * 2 ** attempt)
 
 def load_docs_file():
     try:
@@ -19,16 +130,32 @@ def save_docs_file(docs):
     with open(FILE_NAME, 'w') as f:
         json.dump(docs, f)
 
-def copy_file_to_db():
-    docs = load_docs_file()
+def connect_db():
     con = sqlite3.connect(DB_NAME)
-    cur = con.cursor()
-    cur.execute('CREATE TABLE IF NOT EXISTS docs (uid TEXT NOT NULL PRIMARY KEY, doc TEXT NOT NULL)')
-    con.commit()
-    for uid in docs:
-        doc = docs[uid]
-        cur.execute('INSERT INTO docs (uid, doc) VALUES (?, ?)', (uid, json.dumps(doc, ensure_ascii = False)))
+    con.execute('CREATE TABLE IF NOT EXISTS docs (uid TEXT NOT NULL PRIMARY KEY, doc TEXT NOT NULL)')
+    # Count updates and deletes of docs, so exports (see citegraph.py) can tell that rows
+    # they already cover changed; new docs are found by their rowid instead
+    con.execute('CREATE TABLE IF NOT EXISTS store_meta (name TEXT NOT NULL PRIMARY KEY, value INTEGER NOT NULL)')
+    con.execute("INSERT OR IGNORE INTO store_meta (name, value) VALUES ('changes', 0)")
+    for event in ['UPDATE', 'DELETE']:
+        con.execute('CREATE TRIGGER IF NOT EXISTS docs_count_%s AFTER %s ON docs BEGIN '
+                    "UPDATE store_meta SET value = value + 1 WHERE name = 'changes'; END" % (event.lower(), event))
     con.commit()
+    return con
+
+def store_changes(con):
+    return con.execute("SELECT value FROM store_meta WHERE name = 'changes'").fetchone()[0]
+
+def copy_file_to_db():
+    # sqlite splits the file into rows itself, so the docs are never decoded in Python
+    try:
+        with open(FILE_NAME, 'r') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    con = connect_db()
+    with con:
+        con.execute('INSERT INTO docs (uid, doc) SELECT key, value FROM json_each(?)', (data,))
     con.close()
 
 def load_docs():
@@ -43,12 +170,15 @@ def load_docs():
     con.close()
     return docs
 
-def save_doc(uid, doc):
+def save_doc(uid, doc, metrics=None):
+    start = time.perf_counter()
     con = sqlite3.connect(DB_NAME)
     cur = con.cursor()
     cur.execute('INSERT INTO docs (uid, doc) VALUES (?, ?)', (uid, json.dumps(doc, ensure_ascii = False)))
     con.commit()
     con.close()
+    if metrics:
+        metrics.record('store_write', time.perf_counter() - start)
 
 class PageParser(HTMLParser):
     def __init__(self):
@@ -117,8 +247,8 @@ def search_doc(query):
     kvs = list(j['items'][0].items())[0][1]
     print(kvs)
 
-def download_doc(doi):
-    r = requests.get('https://dl.acm.org/doi/' + doi)
+def download_doc(doi, metrics=None):
+    r = fetch('GET', 'https://dl.acm.org/doi/' + doi, 'page', metrics)
     page_parser = PageParser()
     page_parser.feed(r.text)
 
@@ -128,14 +258,14 @@ def download_doc(doi):
         doc['title'] = page_parser.title
 
     if page_parser.cbu:
-        r = requests.get('https://dl.acm.org' + page_parser.cbu)
+        r = fetch('GET', 'https://dl.acm.org' + page_parser.cbu, 'citedby', metrics)
         citation_parser = CitationParser()
         citation_parser.feed(r.text)
         doc['citedby'] = citation_parser.links
     else:
         doc['citedby'] = []
 
-    r = requests.post('https://dl.acm.org/action/exportCiteProcCitation', data={
+    r = fetch('POST', 'https://dl.acm.org/action/exportCiteProcCitation', 'citeproc', metrics, data={
         'dois': doi,
         'targetFile': 'custom-bibtex',
         'format': 'bibTex'
@@ -184,8 +314,11 @@ def get_top_ranked(docs, missing):
     queue.add(max(c.items(), key = lambda x: x[1])[0])
     return queue
 
-def download(orig, num_docs):
+def download(orig, num_docs, metrics=None):
+    start = time.perf_counter()
     all_docs = load_docs()
+    if metrics:
+        metrics.record('store_load', time.perf_counter() - start)
 
     docs = {}
     uids = set([orig])
@@ -196,18 +329,21 @@ def download(orig, num_docs):
             missing = uids - set(docs.keys())
             if len(missing) == 0:
                 print('No documents are missing, stopping.')
-                exit()
+                break
             queue |= get_top_ranked(docs, missing)
 
         uid = queue.pop()
-        if uid in all_docs:
-            print('%s: Taking %s from store' % (len(docs) + 1, uid))
+        from_store = uid in all_docs
+        if from_store:
+            if not metrics:
+                print('%s: Taking %s from store' % (len(docs) + 1, uid))
             doc = all_docs[uid]
         else:
-            print('%s: Downloading %s...' % (len(docs) + 1, uid))
-            doc = download_doc(uid)
+            if not metrics:
+                print('%s: Downloading %s...' % (len(docs) + 1, uid))
+            doc = download_doc(uid, metrics)
             all_docs[uid] = doc
-            save_doc(uid, doc)
+            save_doc(uid, doc, metrics)
             #save_docs(all_docs)
 
         docs[uid] = doc
@@ -217,6 +353,14 @@ def download(orig, num_docs):
         if uid == orig:
             queue |= doc_uids - set([orig]) # Possibly unnecessary, to guard against paper that references itself.
 
+        if metrics:
+            # The frontier is everything discovered but not crawled yet
+            metrics.doc_done(from_store, len(uids) - len(docs))
+            sys.stderr.write('\r\033[K' + metrics.progress_line(uid))
+            sys.stderr.flush()
+
+    if metrics:
+        sys.stderr.write('\n')
     return docs
 
 def mostreferenced(docs, orig):
@@ -242,10 +386,17 @@ def info(doc):
     print('cited by: %s' % len(doc['citedby']))
 
 def remove_uid_file(uid):
-    docs = load_docs_file()
-    if uid in docs:
-        del docs[uid]
-    save_docs_file(docs)
+    # A JSON file can only be rewritten as a whole, but at least let sqlite do it without decoding the docs
+    try:
+        with open(FILE_NAME, 'r') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    con = sqlite3.connect(':memory:')
+    (data,) = con.execute('SELECT json_remove(?, ?)', (data, '$.' + json.dumps(uid))).fetchone()
+    con.close()
+    with open(FILE_NAME, 'w') as f:
+        f.write(data)
 
 def remove_uid(uid):
     con = sqlite3.connect(DB_NAME)
@@ -254,21 +405,187 @@ def remove_uid(uid):
     con.commit()
     con.close()
 
+# Store maintenance. Everything below runs as set-based SQL over the JSON1 functions,
+# one transaction per command, and never loads the store into Python.
+
+# A doc is incomplete when it has nothing but its references and citedby lists
+INCOMPLETE_DOC = "NOT EXISTS (SELECT 1 FROM json_each(docs.doc) WHERE json_each.key NOT IN ('references', 'citedby'))"
+
+def prune_incomplete():
+    """Delete docs without any metadata, returns the number of deleted docs"""
+    con = connect_db()
+    with con:
+        n = con.execute('DELETE FROM docs WHERE json_valid(doc) AND ' + INCOMPLETE_DOC).rowcount
+    con.close()
+    return n
+
 def remove_missing_meta():
-    docs = load_docs()
-    uids = list(docs.keys())
-    for uid in uids:
-        doc = docs[uid]
-        if len(set(doc.keys()) - set(['references', 'citedby'])) == 0:
-            remove_uid(uid)
-            del docs[uid]
-    #save_docs(docs)
-
-# doi = '10.5555/2387880.2387905'
-# documents_to_download = 300
-# docs = download(doi, documents_to_download)
-# info(docs[doi])
-# mostreferenced(docs, doi)
-
-test_title = "Building a replicated logging system with Apache Kafka"
-search_doc(test_title)
+    return prune_incomplete()
+
+def dedupe():
+    """Merge docs whose uids only differ in case or surrounding whitespace (DOIs are case-insensitive)
+    into the one with the most fields, and drop repeated uids inside references/citedby lists.
+    The merged doc gets the union of their lists, and links to the dropped uids point to it.
+    Returns (docs deleted, docs with merged or deduplicated lists)."""
+    con = connect_db()
+    with con:
+        # Every duplicate with the rowid and uid of the doc it is merged into
+        con.execute('DROP TABLE IF EXISTS temp.merged')
+        con.execute('''
+            CREATE TEMP TABLE merged AS SELECT rowid AS dup_rowid, uid, keep_rowid, keep_uid FROM (
+                SELECT rowid, uid, ROW_NUMBER() OVER w AS rank,
+                    first_value(rowid) OVER w AS keep_rowid, first_value(uid) OVER w AS keep_uid
+                FROM docs WHERE json_valid(doc)
+                WINDOW w AS (PARTITION BY lower(trim(uid))
+                             ORDER BY (SELECT count(*) FROM json_each(doc)) DESC, length(doc) DESC, rowid))
+            WHERE rank > 1''')
+        updated = set()
+        for key in ['references', 'citedby']:
+            path = '$.' + key
+            # Union of the lists of a kept doc and its duplicates, in that order
+            con.execute('DROP TABLE IF EXISTS temp.merged_lists')
+            con.execute('''
+                CREATE TEMP TABLE merged_lists AS SELECT keep_rowid, json_group_array(DISTINCT value) AS list FROM (
+                    SELECT m.keep_rowid, e.value
+                    FROM (SELECT keep_rowid, keep_rowid AS from_rowid FROM merged
+                          UNION SELECT keep_rowid, dup_rowid FROM merged) AS m
+                        JOIN docs AS d ON d.rowid = m.from_rowid, json_each(d.doc, :path) AS e
+                    WHERE json_type(d.doc, :path) = 'array'
+                    ORDER BY m.keep_rowid, d.rowid != m.keep_rowid, d.rowid, e.id)
+                GROUP BY keep_rowid''', {'path': path})
+            updated.update(rowid for (rowid,) in con.execute('''
+                UPDATE docs SET doc = json_set(doc, :path, json((SELECT list FROM merged_lists WHERE keep_rowid = docs.rowid)))
+                WHERE rowid IN (SELECT keep_rowid FROM merged_lists)
+                RETURNING rowid''', {'path': path}))
+            con.execute('DROP TABLE temp.merged_lists')
+            # Links to merged uids point to the kept doc instead
+            updated.update(rowid for (rowid,) in con.execute('''
+                UPDATE docs SET doc = json_set(doc, :path, (
+                    SELECT json_group_array(coalesce((SELECT keep_uid FROM merged WHERE merged.uid = e.value), e.value))
+                    FROM json_each(docs.doc, :path) AS e))
+                WHERE json_valid(doc) AND json_type(doc, :path) = 'array'
+                    AND EXISTS (SELECT 1 FROM json_each(docs.doc, :path) AS e, merged WHERE merged.uid = e.value)
+                RETURNING rowid''', {'path': path}))
+        deleted = con.execute('DELETE FROM docs WHERE rowid IN (SELECT dup_rowid FROM merged)').rowcount
+        con.execute('DROP TABLE temp.merged')
+        for key in ['references', 'citedby']:
+            path = '$.' + key
+            updated.update(rowid for (rowid,) in con.execute('''
+                UPDATE docs SET doc = json_set(doc, :path,
+                    (SELECT json_group_array(DISTINCT value) FROM json_each(docs.doc, :path)))
+                WHERE json_valid(doc) AND json_type(doc, :path) = 'array'
+                    AND json_array_length(doc, :path) >
+                        (SELECT count(DISTINCT value) FROM json_each(docs.doc, :path))
+                RETURNING rowid''', {'path': path}))
+    con.close()
+    return deleted, len(updated)
+
+def vacuum():
+    """Rebuild the database file to reclaim space left by deleted docs"""
+    con = connect_db()
+    con.isolation_level = None
+    con.execute('PRAGMA optimize')
+    con.execute('VACUUM')
+    con.close()
+
+def export_docs(path):
+    """Stream the store to a JSON lines file of {"uid": ..., "doc": ...}, returns the number of docs"""
+    con = connect_db()
+    n = 0
+    with open(path, 'w') as f:
+        for (line,) in con.execute("SELECT json_object('uid', uid, 'doc', json(doc)) FROM docs WHERE json_valid(doc) ORDER BY uid"):
+            f.write(line)
+            f.write('\n')
+            n += 1
+    con.close()
+    return n
+
+def import_docs(path):
+    """Upsert docs from a JSON lines file written by export_docs, returns the number of docs"""
+    con = connect_db()
+    with open(path, 'r') as f, con:
+        lines = ({'line': line} for line in f if line.strip())
+        n = con.executemany('''
+            INSERT INTO docs (uid, doc) SELECT json_extract(:line, '$.uid'), json_extract(:line, '$.doc') WHERE true
+            ON CONFLICT(uid) DO UPDATE SET doc = excluded.doc''', lines).rowcount
+    con.close()
+    return n
+
+def store_stats():
+    """Counts and integrity checks for the store, as a dict"""
+    con = connect_db()
+    stats = {}
+    stats['integrity'] = con.execute('PRAGMA quick_check').fetchone()[0]
+    row = con.execute('''
+        SELECT count(*), sum(NOT json_valid(doc)), sum(length(doc)) FROM docs''').fetchone()
+    stats['docs'], stats['invalid_json'], stats['doc_bytes'] = row[0], row[1] or 0, row[2] or 0
+    row = con.execute('''
+        SELECT sum(json_extract(doc, '$.title') IS NOT NULL),
+               sum(json_extract(doc, '$.date') IS NOT NULL),
+               sum(json_extract(doc, '$.authors') IS NOT NULL),
+               sum(''' + INCOMPLETE_DOC + '''),
+               sum(json_array_length(doc, '$.references')),
+               sum(json_array_length(doc, '$.citedby'))
+        FROM docs WHERE json_valid(doc)''').fetchone()
+    keys = ['with_title', 'with_date', 'with_authors', 'incomplete', 'references', 'citedby']
+    stats.update((key, value or 0) for key, value in zip(keys, row))
+    stats['case_duplicates'] = con.execute('SELECT count(*) - count(DISTINCT lower(trim(uid))) FROM docs').fetchone()[0]
+    # Uids that are linked from the store but not in it yet
+    stats['frontier'] = con.execute('''
+        SELECT count(DISTINCT e.value) FROM docs, json_each(docs.doc, '$.references') AS e
+        WHERE json_valid(docs.doc) AND e.value NOT IN (SELECT uid FROM docs)''').fetchone()[0]
+    page_size = con.execute('PRAGMA page_size').fetchone()[0]
+    stats['file_bytes'] = con.execute('PRAGMA page_count').fetchone()[0] * page_size
+    stats['free_bytes'] = con.execute('PRAGMA freelist_count').fetchone()[0] * page_size
+    con.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl the ACM digital library citation graph')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('crawl', help='crawl documents around a DOI and rank the most referenced ones')
+    p.add_argument('doi', help='e.g. 10.5555/2387880.2387905')
+    p.add_argument('-n', '--num-docs', type=int, default=300)
+    p.add_argument('--metrics', default=METRICS_FILE, help='where to write the crawl metrics JSON')
+
+    p = commands.add_parser('search', help='search ACM for a title')
+    p.add_argument('title')
+
+    commands.add_parser('prune', help='delete docs that have no metadata besides references/citedby')
+    commands.add_parser('dedupe', help='merge docs whose uids differ only in case and dedupe their uid lists')
+    commands.add_parser('vacuum', help='compact the database file')
+    commands.add_parser('stats', help='print document counts and integrity checks')
+    p = commands.add_parser('export', help='export the store to a JSON lines file')
+    p.add_argument('file')
+    p = commands.add_parser('import', help='import (upsert) docs from a JSON lines file')
+    p.add_argument('file')
+
+    args = parser.parse_args()
+    if args.command == 'crawl':
+        metrics = CrawlMetrics()
+        try:
+            docs = download(args.doi, args.num_docs, metrics)
+        finally:
+            metrics.save(args.metrics)
+            print('Crawl metrics written to %s' % args.metrics)
+        info(docs[args.doi])
+        mostreferenced(docs, args.doi)
+    elif args.command == 'search':
+        search_doc(args.title)
+    elif args.command == 'prune':
+        print('Deleted %d incomplete docs' % prune_incomplete())
+    elif args.command == 'dedupe':
+        print('Merged %d duplicate docs, merged or deduplicated lists of %d docs' % dedupe())
+    elif args.command == 'vacuum':
+        vacuum()
+    elif args.command == 'stats':
+        for key, value in store_stats().items():
+            print('%s: %s' % (key, value))
+    elif args.command == 'export':
+        print('Exported %d docs to %s' % (export_docs(args.file), args.file))
+    elif args.command == 'import':
+        print('Imported %d docs from %s' % (import_docs(args.file), args.file))
+
+if __name__ == '__main__':
+    main()
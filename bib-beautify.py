@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import bibtexparser
+import functools
 import glob
+import multiprocessing
 import os 
 from fuzzywuzzy import fuzz
 from bs4 import BeautifulSoup
@@ -11,6 +13,8 @@ import sqlite3
 import re
 import time
 import sys
+from corpus import CompactCorpus, KeyIndex, entry_aliases, key_files, load_csbib
+from dblpimport import DBLP_STORE, lookup_title, normalize_title, plain_text
 
 # Get the directory where this script is located (csbib directory)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -114,19 +118,6 @@ VENUE_MONTHS = {
     'csur': None
 }
 
-# Parse command line arguments
-n = len(sys.argv)
-if n < 2:
-    print("Usage: python bib-beautify.py <input.bib> [output.bib]")
-    print("  If output.bib is not specified, creates <input>-beautified.bib")
-    sys.exit(1)
-
-SRC_FILE = sys.argv[1]
-TGT_FILE = SRC_FILE.replace('.bib', '-beautified.bib')
-if n > 2:
-    TGT_FILE = sys.argv[2]
-
-
 def search_doc(query):
     time.sleep(10)
     kvs = {}
@@ -223,6 +214,10 @@ def process_title(title):
 
     return ' '.join(result_words)
 
+def key_part(text):
+    """Reduce a name to the characters allowed in cite keys: [a-z0-9]"""
+    return re.sub(r'[^a-z0-9]', '', plain_text(text))
+
 def generate_cite_key(entry):
     """Generate citation key following convention: lastnameYYfirstword"""
     # Get first author's last name
@@ -249,32 +244,35 @@ def generate_cite_key(entry):
         if len(parts) > 1 and parts[-2].lower() in ['van', 'von', 'de', 'der', 'den', 'del', 'da', 'le', 'la']:
             last_name = parts[-1]
 
+    last_name = key_part(last_name) or "unknown"
+
     # Get year (last 2 digits)
-    year = entry.get("year", "00")
-    year_short = str(year)[-2:] if year else "00"
+    year = key_part(str(entry.get("year", "")))
+    year_short = year[-2:] if year else "00"
 
     # Get first word of title (excluding special characters and articles)
     title = entry.get("title", "")
     if not title:
-        return f"{last_name.lower()}{year_short}"
+        return f"{last_name}{year_short}"
 
-    # Remove LaTeX commands and special chars from title
-    title_clean = re.sub(r'[{}\\]', '', title)
-    title_clean = re.sub(r'[^\w\s]', ' ', title_clean)
-
-    # Split into words and get first meaningful word (skip articles)
-    words = title_clean.split()
+    # Split into words and get first meaningful word (skip articles).
+    # Compound words keep their first part (fault-tolerant -> fault),
+    # unless it is a single letter (H-Store -> hstore)
     skip_words = ['a', 'an', 'the', 'on', 'in', 'at', 'for', 'to', 'of', 'with']
     first_word = ""
-    for word in words:
-        if word.lower() not in skip_words:
-            first_word = word.lower()
+    for word in title.split():
+        parts = re.findall(r'[a-z0-9]+', plain_text(word))
+        if not parts:
+            continue
+        word = parts[0] + parts[1] if len(parts) > 1 and len(parts[0]) == 1 else parts[0]
+        if word not in skip_words:
+            first_word = word
             break
 
     if not first_word:
         first_word = "paper"
 
-    return f"{last_name.lower()}{year_short}{first_word}"
+    return f"{last_name}{year_short}{first_word}"
 
 def detect_known_venue(entry):
     """Detect if entry is from a known conference/journal"""
@@ -289,6 +287,29 @@ def detect_known_venue(entry):
             return venue
     return None
 
+def resolve_local(entry, venue_abbr):
+    """Resolve an unmatched entry against the local dblp store.
+
+    Returns (entry completed with dblp metadata, venue abbreviation), or None.
+    """
+    if "title" not in entry or not os.path.exists(DBLP_STORE):
+        return None
+    pub = lookup_title(entry["title"], venue_abbr, DBLP_STORE)
+    if not pub or not pub["venue"]:
+        return None
+    if fuzz.token_set_ratio(pub["title"], entry["title"]) != 100:
+        return None
+
+    resolved = entry.copy()
+    resolved["ENTRYTYPE"] = pub["type"]
+    if pub["authors"]:
+        resolved["author"] = pub["authors"]
+    if pub["year"]:
+        resolved["year"] = pub["year"]
+    if pub["doi"] and "doi" not in resolved:
+        resolved["doi"] = pub["doi"]
+    return resolved, pub["venue"]
+
 def get_venue_template(venue_abbr):
     """Get a template entry from the venue's database file"""
     venue_file = os.path.join(SCRIPT_DIR, f"{venue_abbr}.bib")
@@ -306,8 +327,8 @@ def get_venue_template(venue_abbr):
         return None
     return None
 
-def beautify_with_template(entry, template, venue_abbr):
-    """Beautify entry using template from known venue"""
+def beautify_with_template(entry, template, venue_abbr, own_key=None):
+    """Beautify entry using template from known venue, own_key is a key the entry may keep (see KeyIndex.unique)"""
     beautified = entry.copy()
 
     # Copy formatting style from template
@@ -347,11 +368,29 @@ def beautify_with_template(entry, template, venue_abbr):
     if "pages" in beautified:
         del beautified["pages"]
 
-    # Generate citation key following convention
-    beautified["ID"] = generate_cite_key(beautified)
+    # Generate citation key following convention, disambiguated against all keys and aliases in use
+    beautified["ID"] = key_index.unique(generate_cite_key(beautified), own_key)
 
     return beautified
 
+def rekey_report(corpus, directory):
+    """Report database entries whose key does not follow the lastnameYYfirstword convention"""
+    files = key_files(directory)
+    index = KeyIndex.from_corpus(corpus)
+    for key in index.duplicates:
+        print(f"{files.get(key, '?')}: duplicate key or alias {key}")
+
+    count = 0
+    for i in range(len(corpus)):
+        entry = corpus.entry(i)
+        base = generate_cite_key(entry)
+        # A numeric suffix is how generated keys are disambiguated, so it still follows the convention
+        if re.fullmatch(re.escape(base) + r'\d*', entry["ID"]):
+            continue
+        print(f"{files.get(entry['ID'], '?')}: {entry['ID']} -> {index.unique(base)}")
+        count += 1
+    print(f"{count} of {len(corpus)} entries don't follow the convention")
+
 def prompt_add_to_database(entry, venue_abbr):
     """Prompt user to add entry to database"""
     writer = bibtexparser.bwriter.BibTexWriter()
@@ -464,135 +503,457 @@ def append_to_venue_database(entry, venue_abbr):
     with open(venue_file, 'a') as f:
         f.write(entry_str)
 
-# Load all BibTeX database files from the csbib directory
-bib_pattern = os.path.join(SCRIPT_DIR, '*.bib')
-title_pattern = os.path.join(SCRIPT_DIR, 'title*.bib')
-files = list(set(glob.glob(bib_pattern)) - set(glob.glob(title_pattern)))
-files.insert(0, os.path.join(SCRIPT_DIR, "title.bib"))
-
-data = ""
-for f in files:
-    data += open(f).read()
-# d1 = open("title_short.bib", "r").read()
-# d2 = open("osdi.bib").read()
-bib_database = bibtexparser.loads(data)
-# print(bib_database.entries)
-
-target_data = open(SRC_FILE)
-# target_data = open("../application/cv/ref.bib")
-target_bib = bibtexparser.load(target_data)
-# print(target_bib.entries)
-
-bib_list = []
-for entry in target_bib.entries: 
-    results = []
-    result = entry
-    r = 0
-    title = ""
-    if "title" in entry.keys():
-        title = entry["title"]
-        for e2 in bib_database.entries:
-            r = fuzz.token_set_ratio(entry["title"], e2["title"]);
-            if r == 100:
-                results.append(e2);
-                print("Found match ratio, " + str(r) + ": " + title)
-    if len(results) > 0:
-        result = results[0]
-    else:
-        print("Nothing found for: " + title)
-        writer = bibtexparser.bwriter.BibTexWriter()
-        db = bibtexparser.bibdatabase.BibDatabase()
-        db.entries = [entry]
-        print(writer.write(db))
-
-        # Check if this is from a known conference/journal
-        venue_abbr = detect_known_venue(entry)
-        if venue_abbr:
-            print(f"Detected known venue: {venue_abbr.upper()}")
-            template = get_venue_template(venue_abbr)
-
-            # Beautify the entry using the template (or defaults if no template)
-            beautified = beautify_with_template(entry, template, venue_abbr)
-
-            # Ask user if they want to add it to the database
-            if prompt_add_to_database(beautified, venue_abbr):
-                insert_entry_chronologically(beautified, venue_abbr)
-                print(f"Entry added to {venue_abbr}.bib database in chronological order")
-                # Add the new entry to the in-memory database so it won't be matched again
-                bib_database.entries.append(beautified)
-
-            result = beautified
+def beautify_file(src_file, tgt_file, interactive=True, keep_layout=False):
+    """Replace entries of src_file with their csbib versions and write the result to tgt_file.
+
+    Non-interactive runs never prompt to add entries to the database and
+    don't print per-entry progress. With keep_layout, an existing tgt_file
+    is only updated where entries changed (see write_keeping_layout). Returns the entries with no csbib match
+    as (title, venue abbreviation or None, key used in the output).
+    """
+    if os.path.abspath(tgt_file) == os.path.abspath(src_file):
+        raise ValueError(f"refusing to overwrite the input {src_file}")
+    with open(src_file) as target_data:
+        target_bib = bibtexparser.load(target_data)
+
+    # The keys of the input are taken too, so new keys never collide with the entries kept as they are.
+    # Keys that csbib does not already use are the input's own, and an entry may keep its own key.
+    own_keys = set()
+    for entry in target_bib.entries:
+        for key in [entry["ID"]] + entry_aliases(entry.get("ids", "")):
+            if key not in key_index:
+                own_keys.add(key)
+                key_index.reserve(key)
+
+    log = print if interactive else lambda *args: None
+    bib_list = []
+    misses = []
+    for entry in target_bib.entries: 
+        results = []
+        result = entry
+        r = 0
+        title = ""
+        if "title" in entry.keys():
+            title = entry["title"]
+            for i, t in enumerate(bib_corpus.titles()):
+                r = fuzz.token_set_ratio(entry["title"], t)
+                if r == 100:
+                    results.append(bib_corpus.entry(i))
+                    log("Found match ratio, " + str(r) + ": " + title)
+        if len(results) > 0:
+            result = results[0]
         else:
-            # Try ACM lookup for VLDB/SIGMOD as before
-            journal = ""
-            if "journal" in entry:
-                journal = entry["journal"].lower()
-            if "booktitle" in entry:
-                journal = entry["booktitle"].lower()
-            # if False:
-            if (entry["ENTRYTYPE"] == "article" or entry["ENTRYTYPE"] == "inproceedings") and ("vldb" in journal or "sigmod" in journal):
-                print("Search ACM database for it")
-                acm_res = search_doc(title)
-                result = {}
-                result["ENTRYTYPE"] = entry["ENTRYTYPE"]
-                result["ID"] = entry["ID"]
-                result["title"] = entry["title"]
-                result["author"] = entry["author"]
-                if len(acm_res) > 0 and fuzz.token_set_ratio(acm_res['title'], title) == 100:
-                    print("Found on ACM")
-                    if acm_res["type"] == "PAPER_CONFERENCE":
-                        result["ENTRYTYPE"] = "inproceedings"
-                        result["booktitle"] = acm_res["container-title"]
-                    elif acm_res["type"] == "ARTICLE":
-                        result["ENTRYTYPE"] = "article"
-                        result["journal"] = acm_res["container-title"]
-                        result["volume"] = acm_res["volume"]
-                        result["number"] = acm_res["issue"]
+            log("Nothing found for: " + title)
+            writer = bibtexparser.bwriter.BibTexWriter()
+            db = bibtexparser.bibdatabase.BibDatabase()
+            db.entries = [entry]
+            log(writer.write(db))
+
+            # Check if this is from a known conference/journal
+            venue_abbr = detect_known_venue(entry)
+            to_beautify = entry
+            local = resolve_local(entry, venue_abbr)
+            if local:
+                to_beautify, venue_abbr = local
+                log("Resolved from local dblp store")
+            if venue_abbr:
+                log(f"Detected known venue: {venue_abbr.upper()}")
+                template = get_venue_template(venue_abbr)
+
+                # Beautify the entry using the template (or defaults if no template)
+                own_key = entry["ID"] if entry["ID"] in own_keys else None
+                beautified = beautify_with_template(to_beautify, template, venue_abbr, own_key)
+
+                # Ask user if they want to add it to the database
+                if interactive and prompt_add_to_database(beautified, venue_abbr):
+                    insert_entry_chronologically(beautified, venue_abbr)
+                    log(f"Entry added to {venue_abbr}.bib database in chronological order")
+                    # Add the new entry to the in-memory database so it won't be matched again
+                    bib_corpus.append(beautified)
+
+                result = beautified
+            else:
+                # Try ACM lookup for VLDB/SIGMOD as before
+                journal = ""
+                if "journal" in entry:
+                    journal = entry["journal"].lower()
+                if "booktitle" in entry:
+                    journal = entry["booktitle"].lower()
+                # if False:
+                if (entry["ENTRYTYPE"] == "article" or entry["ENTRYTYPE"] == "inproceedings") and ("vldb" in journal or "sigmod" in journal):
+                    log("Search ACM database for it")
+                    acm_res = search_doc(title)
+                    result = {}
+                    result["ENTRYTYPE"] = entry["ENTRYTYPE"]
+                    result["ID"] = entry["ID"]
+                    result["title"] = entry["title"]
+                    result["author"] = entry["author"]
+                    if len(acm_res) > 0 and fuzz.token_set_ratio(acm_res['title'], title) == 100:
+                        log("Found on ACM")
+                        if acm_res["type"] == "PAPER_CONFERENCE":
+                            result["ENTRYTYPE"] = "inproceedings"
+                            result["booktitle"] = acm_res["container-title"]
+                        elif acm_res["type"] == "ARTICLE":
+                            result["ENTRYTYPE"] = "article"
+                            result["journal"] = acm_res["container-title"]
+                            result["volume"] = acm_res["volume"]
+                            result["number"] = acm_res["issue"]
+                        else:
+                            log("Error")
+                        result["year"] = "{}".format(acm_res["issued"]["date-parts"][0][0])
+                        result["month"] = "{}".format(acm_res["issued"]["date-parts"][0][1])
+                        db.entries = [result]
+                        log(writer.write(db))
                     else:
-                        print("Error")
-                    result["year"] = "{}".format(acm_res["issued"]["date-parts"][0][0])
-                    result["month"] = "{}".format(acm_res["issued"]["date-parts"][0][1])
-                    db.entries = [result]
-                    print(writer.write(db))
+                        log("Didn't find exact match on ACM")
+                        result = entry
                 else:
-                    print("Didn't find exact match on ACM")
                     result = entry
-            else:
-                result = entry
-    if len(results) > 1: 
-        for e2 in results:
-            if entry["ENTRYTYPE"] == e2["ENTRYTYPE"]:
-                result = e2
-    ids = []
-    if "ids" in result.keys():
-        ids+=result["ids"].split(",")
-
-    # For beautified entries, preserve the original ID in the ids field
-    # but keep the new generated citation key as the main ID
-    if result.get("ID") != entry["ID"]:
-        # This is a beautified entry with a new citation key
-        ids.append(entry["ID"])
-    else:
-        # Not beautified, keep original ID
-        ids.append(entry["ID"])
-        result["ID"] = entry["ID"]
-
-    if "ids" in entry.keys():
-        ids += entry["ids"].split(",")
-    ids = [*(set(ids)-set([result["ID"]]))]
-    if len(ids) > 0:
-        result["ids"] = ",".join(ids)
-    else:
-        result.pop('ids', None)
-    bib_list.append(result) 
-
+            misses.append((title, venue_abbr, result["ID"]))
+        if len(results) > 1: 
+            for e2 in results:
+                if entry["ENTRYTYPE"] == e2["ENTRYTYPE"]:
+                    result = e2
+        ids = []
+        if "ids" in result.keys():
+            ids+=result["ids"].split(",")
+
+        # For beautified entries, preserve the original ID in the ids field
+        # but keep the new generated citation key as the main ID
+        if result.get("ID") != entry["ID"]:
+            # This is a beautified entry with a new citation key
+            ids.append(entry["ID"])
+        else:
+            # Not beautified, keep original ID
+            ids.append(entry["ID"])
+            result["ID"] = entry["ID"]
+
+        if "ids" in entry.keys():
+            ids += entry["ids"].split(",")
+        ids = [k for k in dict.fromkeys(ids) if k != result["ID"]]
+        if len(ids) > 0:
+            result["ids"] = ",".join(ids)
+        else:
+            result.pop('ids', None)
+        bib_list.append(result) 
 
-res_db = bibtexparser.bibdatabase.BibDatabase()
-result_entries = []
-[result_entries.append(x) for x in bib_list if x not in result_entries] 
-res_db.entries = result_entries
 
+    res_db = bibtexparser.bibdatabase.BibDatabase()
+    result_entries = []
+    [result_entries.append(x) for x in bib_list if x not in result_entries] 
+    res_db.entries = result_entries
 
-with open(TGT_FILE, 'w') as bibtex_file:
-    bibtexparser.dump(res_db, bibtex_file)
+    if keep_layout and os.path.exists(tgt_file):
+        if not write_keeping_layout(result_entries, tgt_file):
+            log(f"{tgt_file} is up to date")
+    else:
+        with open(tgt_file, 'w') as bibtex_file:
+            bibtexparser.dump(res_db, bibtex_file)
+
+    return misses
+
+# Start of an entry block, e.g. "@inproceedings{corbett12spanner,"
+BIB_ENTRY_HEADER = re.compile(r'\s*@\s*(\w+)\s*\{\s*([^,\s]*)')
+
+def entry_end(block):
+    """Index just past the brace closing the entry that block starts with"""
+    depth = 0
+    for i in range(block.index('{'), len(block)):
+        if block[i] == '{':
+            depth += 1
+        elif block[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(block.rstrip())
+
+def render_entry(entry):
+    writer = bibtexparser.bwriter.BibTexWriter()
+    db = bibtexparser.bibdatabase.BibDatabase()
+    db.entries = [entry]
+    return writer.write(db).rstrip()
+
+def write_keeping_layout(entries, tgt_file):
+    """Update tgt_file in place with entries, rewriting only the entries that changed.
+
+    Unchanged entries, @string/@comment/@preamble blocks, comments between
+    entries and the order of the file are kept byte for byte; entries no
+    longer in the results are dropped and new ones appended. The file is not touched at all when
+    nothing changed. Returns whether it was written.
+    """
+    with open(tgt_file) as f:
+        text = f.read()
+    old_entries = {e["ID"]: e for e in bibtexparser.loads(text).entries}
+    new_entries = {}
+    for entry in entries:
+        new_entries.setdefault(entry["ID"], entry)
+
+    out = []
+    done = set()
+    for block in re.split(r'(?m)^(?=[ \t]*@)', text):
+        m = BIB_ENTRY_HEADER.match(block)
+        if not m or m.group(1).lower() in ('string', 'comment', 'preamble'):
+            out.append(block)
+            continue
+        # A block runs up to the next entry, only the entry itself is replaced or dropped
+        key = m.group(2)
+        start = block.index('@')
+        end = entry_end(block)
+        if key not in new_entries or key in done:
+            # Keep what follows the entry, without the blank lines that separated it
+            out.append(re.sub(r'^(?:[ \t]*\n)+', '', block[end:]))
+            continue
+        done.add(key)
+        if old_entries.get(key) == new_entries[key]:
+            out.append(block)
+        else:
+            out.append(block[:start] + render_entry(new_entries[key]) + block[end:])
+
+    for key, entry in new_entries.items():
+        if key not in done:
+            if out and not out[-1].endswith('\n\n'):
+                out.append('\n' if out[-1].endswith('\n') else '\n\n')
+            out.append(render_entry(entry) + '\n')
+
+    new_text = ''.join(out)
+    if new_text == text:
+        return False
+    tmp_file = tgt_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(new_text)
+    os.replace(tmp_file, tgt_file)
+    return True
+
+def beautified_path(src_file):
+    """Default output path of src_file, e.g. refs.bib -> refs-beautified.bib"""
+    return os.path.splitext(src_file)[0] + '-beautified.bib'
+
+def batch_inputs(patterns):
+    """Expand files, directories (searched recursively) and glob patterns into input .bib files"""
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = glob.glob(os.path.join(pattern, '**', '*.bib'), recursive=True)
+        else:
+            paths = glob.glob(pattern, recursive=True)
+        paths = [path for path in sorted(paths) if path.endswith('.bib') and not path.endswith('-beautified.bib')]
+        if not paths:
+            print(f"warning: no .bib inputs match {pattern}")
+        for path in paths:
+            if path not in inputs:
+                inputs.append(path)
+    return inputs
+
+def beautify_batch_input(src_file, keep_layout=False):
+    global key_index
+    # Workers handle many inputs, so start each one from the keys loaded from csbib,
+    # as a single-file run would, instead of the keys reserved for previous inputs
+    reserved = set(key_index.keys)
+    try:
+        return src_file, beautify_file(src_file, beautified_path(src_file), False, keep_layout), None
+    except Exception as e:
+        # One unreadable or unparsable input must not abort the whole batch
+        return src_file, [], f"{type(e).__name__}: {e}"
+    finally:
+        key_index.keys = reserved
+
+def init_batch_worker(corpus, index):
+    global bib_corpus, key_index
+    bib_corpus = corpus
+    key_index = index
+
+def beautify_batch(patterns, jobs, keep_layout=False):
+    """Beautify many inputs in parallel workers, all sharing the corpus loaded by the parent.
+
+    Returns the inputs that failed, or None when the patterns match no input at all.
+    """
+    inputs = batch_inputs(patterns)
+    if not inputs:
+        return None
+    all_misses = {}
+    failed = []
+    # The corpus and key index loaded by main() are handed to the workers, so nothing is re-parsed.
+    # With fork they are inherited as is, with spawn (macOS, Windows) they are pickled once per worker.
+    with multiprocessing.Pool(jobs, initializer=init_batch_worker, initargs=(bib_corpus, key_index)) as pool:
+        for src_file, misses, error in pool.imap_unordered(functools.partial(beautify_batch_input, keep_layout=keep_layout), inputs):
+            if error:
+                print(f"{src_file}: failed, {error}")
+                failed.append(src_file)
+                continue
+            print(f"{src_file}: {len(misses)} entries not in csbib")
+            for title, venue_abbr, key in misses:
+                miss = all_misses.setdefault(normalize_title(title), {'title': title, 'venue': venue_abbr, 'key': key, 'inputs': []})
+                miss['venue'] = miss['venue'] or venue_abbr
+                miss['inputs'].append(src_file)
+    print_miss_report(all_misses, len(inputs) - len(failed))
+    if failed:
+        print(f"\n{len(failed)} of {len(inputs)} inputs failed: {', '.join(sorted(failed))}")
+    return failed
+
+def print_miss_report(all_misses, num_inputs):
+    """Print entries missing from csbib across all inputs, most needed first"""
+    misses = sorted(all_misses.values(), key=lambda m: (-len(m['inputs']), m['venue'] or '~', m['title'].lower()))
+    print(f"\n{len(misses)} distinct entries missing from csbib across {num_inputs} inputs:")
+    for miss in misses:
+        venue = miss['venue'] or '?'
+        print(f"{len(miss['inputs']):4d}  {venue:8s} {miss['key']}: {miss['title']}")
+        print(f"      {', '.join(sorted(set(miss['inputs'])))}")
+
+def doc_to_entry(uid, doc):
+    """Turn a crawled ACM doc into a bib entry, beautified when its venue can be resolved"""
+    entry = {"ENTRYTYPE": "misc", "ID": uid, "title": doc["title"], "doi": uid}
+    if "authors" in doc:
+        entry["author"] = doc["authors"].replace(", ", " and ")
+    if doc.get("date", "")[:4].isdigit():
+        entry["year"] = doc["date"][:4]
+
+    local = resolve_local(entry, None)
+    if local:
+        resolved, venue_abbr = local
+        return beautify_with_template(resolved, get_venue_template(venue_abbr), venue_abbr)
+    entry["title"] = process_title(entry["title"])
+    entry["ID"] = key_index.unique(generate_cite_key(entry))
+    return entry
+
+def recommend(seed, tgt_file, num, graph_dir=None):
+    """Recommend papers to cite for a seed DOI or a paper's ref.bib, using the local crawl (see acmdownload.py).
+
+    Candidates that csbib already has are reported with their key, the
+    others are written to tgt_file as entries ready to curate.
+    """
+    # Imported here so that numpy and the crawler are only needed for recommend
+    from acmdownload import DB_NAME, connect_db
+    from citegraph import GRAPH_DIR, CitationGraph, export_graph, related
+
+    # connect_db would create an empty store (and export_graph an empty graph) in the working directory
+    if not os.path.exists(DB_NAME):
+        print(f"No crawl in {os.path.abspath(DB_NAME)}, crawl first with acmdownload.py")
+        return False
+    if graph_dir is None:
+        graph_dir = GRAPH_DIR
+    start = time.time()
+    export_graph(graph_dir)
+    graph = CitationGraph(graph_dir)
+    uid_index = graph.uid_index()
+
+    exclude = []
+    if seed.endswith('.bib'):
+        with open(seed) as f:
+            seed_entries = bibtexparser.load(f).entries
+        title_index = None
+        seeds = []
+        for entry in seed_entries:
+            if entry.get("doi") in uid_index:
+                seeds.append(uid_index[entry["doi"]])
+                continue
+            if title_index is None:
+                title_index = {normalize_title(graph.title(i)): i for i in range(len(graph)) if graph.crawled[i]}
+            i = title_index.get(normalize_title(entry.get("title", "")))
+            if i is not None:
+                seeds.append(i)
+        print(f"{len(seeds)} of {len(seed_entries)} entries of {seed} found in the crawl")
+    elif seed in uid_index:
+        seeds = [uid_index[seed]]
+        # The seed paper already cites its references
+        exclude = list(graph.references(seeds[0]))
+    else:
+        print(f"{seed} is not in the crawl, crawl it first with acmdownload.py")
+        return
+    if not seeds:
+        return
+
+    results = related(graph, seeds, exclude, num)
+    print(f"Scored {len(graph)} papers in {time.time() - start:.2f}s")
+
+    csbib_titles = {normalize_title(t): i for i, t in enumerate(bib_corpus.titles())}
+    con = connect_db()
+    missing = []
+    for rank, (i, score, cocited, coupled) in enumerate(results, 1):
+        uid = graph.uid(i)
+        title = graph.title(i)
+        j = csbib_titles.get(normalize_title(title)) if title else None
+        if j is not None:
+            status = "in csbib as " + bib_corpus.get(j, "ID")
+        elif graph.crawled[i]:
+            status = "missing"
+            row = con.execute('SELECT doc FROM docs WHERE uid = ?', (uid,)).fetchone()
+            doc = json.loads(row[0])
+            if "title" in doc:
+                missing.append(doc_to_entry(uid, doc))
+        else:
+            status = "not crawled"
+        print(f"{rank:3d}. {score:4d} ({cocited} co-cited, {coupled} shared refs) {uid}: {title or '???'} [{status}]")
+    con.close()
 
+    db = bibtexparser.bibdatabase.BibDatabase()
+    db.entries = missing
+    with open(tgt_file, 'w') as bibtex_file:
+        bibtexparser.dump(db, bibtex_file)
+    print(f"{len(missing)} entries missing from csbib written to {tgt_file}")
+
+def main():
+    global bib_corpus, key_index
+
+    # Parse command line arguments
+    keep_layout = '--keep-layout' in sys.argv
+    if keep_layout:
+        sys.argv.remove('--keep-layout')
+    n = len(sys.argv)
+    if n < 2:
+        print("Usage: python bib-beautify.py [--keep-layout] <input.bib> [output.bib]")
+        print("  If output.bib is not specified, creates <input>-beautified.bib")
+        print("  --keep-layout only rewrites the entries of an existing output that changed")
+        print("       python bib-beautify.py [--keep-layout] --batch [-j N] <input.bib|dir|glob>...")
+        print("  Beautifies every input to <input>-beautified.bib in N parallel workers, then reports all misses")
+        print("       python bib-beautify.py recommend <doi|ref.bib> [-n N] [-o recommended.bib]")
+        print("  Recommends the top N papers to cite from the local crawl, writing the ones missing from csbib")
+        print("       python bib-beautify.py rekey --dry-run")
+        print("  Reports database entries whose key does not follow the lastnameYYfirstword convention")
+        sys.exit(1)
+
+    # Load all BibTeX database files from the csbib directory into a compact matching corpus
+    bib_corpus = CompactCorpus.from_entries(load_csbib(SCRIPT_DIR))
+    key_index = KeyIndex.from_corpus(bib_corpus)
+
+    if sys.argv[1] == 'rekey':
+        if '--dry-run' not in sys.argv[2:]:
+            print("rekey only supports --dry-run: rename the reported keys by hand and keep the old key in ids")
+            sys.exit(1)
+        rekey_report(bib_corpus, SCRIPT_DIR)
+    elif sys.argv[1] == 'recommend' and n > 2:
+        args = sys.argv[3:]
+        num = 20
+        tgt_file = 'recommended.bib'
+        while len(args) > 1:
+            if args[0] == '-n':
+                num = int(args[1])
+            elif args[0] == '-o':
+                tgt_file = args[1]
+            args = args[2:]
+        if recommend(sys.argv[2], tgt_file, num) is False:
+            sys.exit(1)
+    elif sys.argv[1] == '--batch':
+        args = sys.argv[2:]
+        jobs = os.cpu_count()
+        if len(args) > 1 and args[0] == '-j':
+            jobs = int(args[1])
+            args = args[2:]
+        failed = beautify_batch(args, jobs, keep_layout)
+        if failed is None:
+            print("No .bib inputs to beautify")
+            sys.exit(1)
+        if failed:
+            sys.exit(1)
+    else:
+        src_file = sys.argv[1]
+        tgt_file = beautified_path(src_file)
+        if n > 2:
+            tgt_file = sys.argv[2]
+        try:
+            beautify_file(src_file, tgt_file, keep_layout=keep_layout)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
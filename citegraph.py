@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import numpy as np
+from acmdownload import connect_db, store_changes
+
+GRAPH_DIR = 'graph'
+FORMAT_VERSION = 2
+
+# Array files of an exported graph; node ids index the uid dictionary
+#   uids.bin, uid_offsets.npy          utf-8 uids, node i is uids[uid_offsets[i]:uid_offsets[i+1]]
+#   titles.bin, title_offsets.npy      same for titles, empty when unknown
+#   crawled.npy                        bool, whether the node is a doc in the store (vs. only linked to)
+#   year.npy                           int16, 0 when unknown
+#   refs_indptr.npy, refs_indices.npy  CSR of each doc's references
+#   citedby_indptr.npy, citedby_indices.npy  CSR of each doc's citedby list
+#   manifest.json                      counts, plus what incremental exports resume from or invalidate on
+
+
+def save_array(path, name, array):
+    tmp = os.path.join(path, name + '.tmp.npy')
+    np.save(tmp, array)
+    os.replace(tmp, os.path.join(path, name + '.npy'))
+
+
+def save_buffer(path, name, chunks):
+    tmp = os.path.join(path, name + '.tmp')
+    with open(tmp, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def load_buffer(path, name):
+    filename = os.path.join(path, name)
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(filename, dtype=np.uint8, mode='r')
+
+
+def to_csr(src, dst, num_nodes):
+    """Build CSR (indptr, indices) from edge lists, keeping the order of edges within a row"""
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32)
+
+
+def from_csr(indptr, indices):
+    src = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    return src, np.asarray(indices, dtype=np.int32)
+
+
+class CitationGraph:
+    """A graph exported by export_graph, opened with zero-copy memory-mapped arrays"""
+
+    def __init__(self, path=GRAPH_DIR):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        arrays = ['uid_offsets', 'title_offsets', 'crawled', 'year',
+                  'refs_indptr', 'refs_indices', 'citedby_indptr', 'citedby_indices']
+        for name in arrays:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.uid_bytes = load_buffer(path, 'uids.bin')
+        self.title_bytes = load_buffer(path, 'titles.bin')
+        self._uid_index = None
+
+    def __len__(self):
+        return len(self.crawled)
+
+    def uid(self, i):
+        return bytes(self.uid_bytes[self.uid_offsets[i]:self.uid_offsets[i + 1]]).decode('utf-8')
+
+    def title(self, i):
+        return bytes(self.title_bytes[self.title_offsets[i]:self.title_offsets[i + 1]]).decode('utf-8')
+
+    def uid_index(self):
+        """Map uid -> node id, built on first use"""
+        if self._uid_index is None:
+            offsets = self.uid_offsets.tolist()
+            data = bytes(self.uid_bytes)
+            self._uid_index = {data[offsets[i]:offsets[i + 1]].decode('utf-8'): i for i in range(len(self))}
+        return self._uid_index
+
+    def references(self, i):
+        return self.refs_indices[self.refs_indptr[i]:self.refs_indptr[i + 1]]
+
+    def citedby(self, i):
+        return self.citedby_indices[self.citedby_indptr[i]:self.citedby_indptr[i + 1]]
+
+
+def citation_edges(graph):
+    """All distinct (citing, cited) node pairs, from both the references and the cited-by lists"""
+    n = len(graph)
+    refs_src, refs_dst = from_csr(graph.refs_indptr, graph.refs_indices)
+    cited, citing = from_csr(graph.citedby_indptr, graph.citedby_indices)
+    pairs = np.concatenate([refs_src, citing]).astype(np.int64) * n + np.concatenate([refs_dst, cited])
+    pairs.sort()
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])] if len(pairs) else pairs
+    return (pairs // n).astype(np.int32), (pairs % n).astype(np.int32)
+
+
+def related(graph, seeds, exclude=(), num=20, edges=None):
+    """Rank papers related to the seed nodes by co-citation plus shared references.
+
+    A candidate scores one point for every paper that cites both it and a
+    seed, and one for every reference it shares with the seeds. Seeds and
+    the exclude nodes are never returned. Returns a list of
+    (node, score, co-citations, shared references), best first.
+    """
+    n = len(graph)
+    src, dst = edges if edges is not None else citation_edges(graph)
+
+    is_seed = np.zeros(n, dtype=bool)
+    is_seed[list(seeds)] = True
+
+    citers = np.zeros(n, dtype=bool)
+    citers[src[is_seed[dst]]] = True
+    cocited = np.bincount(dst[citers[src]], minlength=n)
+
+    seed_refs = np.zeros(n, dtype=bool)
+    seed_refs[dst[is_seed[src]]] = True
+    coupled = np.bincount(src[seed_refs[dst]], minlength=n)
+
+    score = cocited + coupled
+    score[is_seed] = 0
+    score[list(exclude)] = 0
+
+    num = min(num, n)
+    if num == 0:
+        return []
+    top = np.argpartition(-score, num - 1)[:num]
+    top = top[np.lexsort((top, -score[top]))]
+    return [(int(i), int(score[i]), int(cocited[i]), int(coupled[i])) for i in top if score[i] > 0]
+
+
+def export_graph(path=GRAPH_DIR, full=False):
+    """Export the crawled graph in docs.db to path as memory-mappable arrays.
+
+    Unless full is set, an existing export is extended with the docs added to
+    the store since, and only falls back to a full export when docs it covers
+    were updated or deleted. Returns the manifest.
+    """
+    os.makedirs(path, exist_ok=True)
+    con = connect_db()
+    changes = store_changes(con)
+
+    graph = None
+    if not full and os.path.exists(os.path.join(path, 'manifest.json')):
+        graph = CitationGraph(path)
+        manifest = graph.manifest
+        rows = con.execute('SELECT count(*) FROM docs WHERE rowid <= ? AND json_valid(doc)',
+                           (manifest['last_rowid'],)).fetchone()[0]
+        if manifest['format'] != FORMAT_VERSION or rows != manifest['rows'] or changes != manifest['changes']:
+            graph = None
+        elif con.execute('SELECT max(rowid) FROM docs').fetchone()[0] == manifest['last_rowid']:
+            # Nothing crawled since the last export
+            con.close()
+            return manifest
+
+    if graph is not None:
+        # Node ids of an incremental export stay stable, new uids are appended.
+        # The existing arrays stay memory-mapped and are only copied into the new files.
+        index = graph.uid_index()
+        num_old = len(graph)
+        old_edges = {'refs': from_csr(graph.refs_indptr, graph.refs_indices),
+                     'citedby': from_csr(graph.citedby_indptr, graph.citedby_indices)}
+        last_rowid = graph.manifest['last_rowid']
+        rows = graph.manifest['rows']
+    else:
+        index = {}
+        num_old = 0
+        old_edges = None
+        last_rowid = 0
+        rows = 0
+
+    new_uids = []
+
+    def node(uid):
+        i = index.get(uid)
+        if i is None:
+            i = num_old + len(new_uids)
+            index[uid] = i
+            new_uids.append(uid)
+        return i
+
+    # Nodes and metadata of docs added since the last export
+    new_crawled = []
+    new_years = {}
+    new_titles = {}
+    new_last_rowid = last_rowid
+    for rowid, uid, title, date in con.execute('''
+            SELECT rowid, uid, json_extract(doc, '$.title'), json_extract(doc, '$.date')
+            FROM docs WHERE rowid > ? AND json_valid(doc) ORDER BY rowid''', (last_rowid,)):
+        i = node(uid)
+        new_crawled.append(i)
+        if date and date[:4].isdigit():
+            new_years[i] = int(date[:4])
+        if title:
+            new_titles[i] = title
+        new_last_rowid = rowid
+        rows += 1
+
+    edges = {}
+    for key, name in [('references', 'refs'), ('citedby', 'citedby')]:
+        src = []
+        dst = []
+        for uid, value in con.execute('''
+                SELECT docs.uid, e.value FROM docs, json_each(docs.doc, '$.' || ?) AS e
+                WHERE docs.rowid > ? AND docs.rowid <= ? AND json_valid(docs.doc)
+                ORDER BY docs.rowid, e.id''', (key, last_rowid, new_last_rowid)):
+            src.append(index[uid])
+            dst.append(node(value))
+        edges[name] = (np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32))
+    con.close()
+
+    num_nodes = num_old + len(new_uids)
+
+    crawled = np.zeros(num_nodes, dtype=bool)
+    year = np.zeros(num_nodes, dtype=np.int16)
+    if graph is not None:
+        crawled[:num_old] = graph.crawled
+        year[:num_old] = graph.year
+    crawled[new_crawled] = True
+    year[list(new_years)] = list(new_years.values())
+
+    # New uids are appended to the old buffer
+    new_uid_bytes = [uid.encode('utf-8') for uid in new_uids]
+    uid_chunks = ([graph.uid_bytes] if graph is not None else []) + new_uid_bytes
+    uid_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    if graph is not None:
+        uid_offsets[:num_old + 1] = graph.uid_offsets
+    uid_offsets[num_old + 1:] = uid_offsets[num_old] + np.cumsum([len(u) for u in new_uid_bytes], dtype=np.int64)
+
+    # Old nodes may get a title once crawled, so old titles are copied in runs between the changed ones
+    title_lengths = np.zeros(num_nodes, dtype=np.int64)
+    if graph is not None:
+        title_lengths[:num_old] = np.diff(graph.title_offsets)
+    title_chunks = []
+    pos = 0
+    for i in sorted(new_titles):
+        end = min(i, num_old)
+        if pos < end:
+            title_chunks.append(graph.title_bytes[graph.title_offsets[pos]:graph.title_offsets[end]])
+        pos = max(pos, min(i + 1, num_old))
+        title = new_titles[i].encode('utf-8')
+        title_chunks.append(title)
+        title_lengths[i] = len(title)
+    if pos < num_old:
+        title_chunks.append(graph.title_bytes[graph.title_offsets[pos]:graph.title_offsets[num_old]])
+    title_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(title_lengths, out=title_offsets[1:])
+
+    for name, (src, dst) in edges.items():
+        if old_edges:
+            src = np.concatenate([old_edges[name][0], src])
+            dst = np.concatenate([old_edges[name][1], dst])
+        indptr, indices = to_csr(src, dst, num_nodes)
+        save_array(path, name + '_indptr', indptr)
+        save_array(path, name + '_indices', indices)
+
+    save_buffer(path, 'uids.bin', uid_chunks)
+    save_array(path, 'uid_offsets', uid_offsets)
+    save_buffer(path, 'titles.bin', title_chunks)
+    save_array(path, 'title_offsets', title_offsets)
+    save_array(path, 'crawled', crawled)
+    save_array(path, 'year', year)
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'nodes': num_nodes,
+        'docs': int(crawled.sum()),
+        'refs_edges': int(len(edges['refs'][0]) + (len(old_edges['refs'][0]) if old_edges else 0)),
+        'citedby_edges': int(len(edges['citedby'][0]) + (len(old_edges['citedby'][0]) if old_edges else 0)),
+        'rows': rows,
+        'last_rowid': new_last_rowid,
+        # Update/delete counter of the store, see acmdownload.connect_db
+        'changes': changes,
+    }
+    with open(os.path.join(path, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the crawled citation graph as memory-mappable arrays')
+    parser.add_argument('out', nargs='?', default=GRAPH_DIR, help='output directory')
+    parser.add_argument('--full', action='store_true', help='re-export everything instead of appending new docs')
+    args = parser.parse_args()
+    manifest = export_graph(args.out, args.full)
+    print('%d nodes (%d docs), %d reference and %d cited-by edges in %s' % (
+        manifest['nodes'], manifest['docs'], manifest['refs_edges'], manifest['citedby_edges'], args.out))
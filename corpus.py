@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+from array import array
+import bibtexparser
+import glob
+import os
+import re
+import sys
+import tracemalloc
+
+
+def load_csbib(directory):
+    """Parse all csbib venue files in directory, title.bib first so @string macros resolve"""
+    bib_pattern = os.path.join(directory, '*.bib')
+    title_pattern = os.path.join(directory, 'title*.bib')
+    files = sorted(set(glob.glob(bib_pattern)) - set(glob.glob(title_pattern)))
+    files.insert(0, os.path.join(directory, "title.bib"))
+
+    data = ""
+    for f in files:
+        with open(f) as fp:
+            data += fp.read()
+    return bibtexparser.loads(data).entries
+
+
+class CompactCorpus:
+    """Columnar, low-overhead store for a large matching corpus of bib entries.
+
+    Fields with few distinct values (entry type, venue, month, year...) are kept
+    as 4-byte ids into a shared symbol table, so each distinct string exists
+    once. Mostly-unique fields (key, title, author) are kept as utf-8 in one
+    buffer per field, addressed by an offsets array; an empty value means the
+    field is absent. Anything else goes to a sparse per-entry dict.
+
+    Entries are materialized as plain dicts on demand with entry(i), so code
+    written against bibtexparser entries keeps working.
+    """
+
+    INTERNED_FIELDS = ('ENTRYTYPE', 'booktitle', 'journal', 'month', 'year', 'volume', 'number', 'publisher', 'address')
+    BUFFERED_FIELDS = ('ID', 'title', 'author')
+
+    def __init__(self):
+        self.symbols = [None]
+        self.symbol_ids = {}
+        self.columns = {field: array('I') for field in self.INTERNED_FIELDS}
+        self.buffers = {field: bytearray() for field in self.BUFFERED_FIELDS}
+        self.offsets = {field: array('Q', [0]) for field in self.BUFFERED_FIELDS}
+        self.extras = {}
+        self.size = 0
+
+    @classmethod
+    def from_entries(cls, entries):
+        corpus = cls()
+        for entry in entries:
+            corpus.append(entry)
+        return corpus
+
+    def intern(self, value):
+        sid = self.symbol_ids.get(value)
+        if sid is None:
+            sid = len(self.symbols)
+            self.symbols.append(value)
+            self.symbol_ids[value] = sid
+        return sid
+
+    def append(self, entry):
+        for field in self.INTERNED_FIELDS:
+            value = entry.get(field)
+            self.columns[field].append(0 if value is None else self.intern(value))
+        for field in self.BUFFERED_FIELDS:
+            buf = self.buffers[field]
+            buf += entry.get(field, '').encode('utf-8')
+            self.offsets[field].append(len(buf))
+        extra = {k: v for k, v in entry.items() if k not in self.INTERNED_FIELDS and k not in self.BUFFERED_FIELDS}
+        if extra:
+            self.extras[self.size] = extra
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def get(self, i, field, default=None):
+        if field in self.columns:
+            value = self.symbols[self.columns[field][i]]
+            return default if value is None else value
+        if field in self.buffers:
+            offsets = self.offsets[field]
+            start, end = offsets[i], offsets[i + 1]
+            if start == end:
+                return default
+            return self.buffers[field][start:end].decode('utf-8')
+        return self.extras.get(i, {}).get(field, default)
+
+    def titles(self):
+        """Iterate over all titles in order, without materializing entries"""
+        buf = self.buffers['title']
+        offsets = self.offsets['title']
+        for i in range(self.size):
+            yield buf[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    def entry(self, i):
+        """Materialize entry i as a bibtexparser-style dict"""
+        entry = {}
+        for field in self.BUFFERED_FIELDS + self.INTERNED_FIELDS:
+            value = self.get(i, field)
+            if value is not None:
+                entry[field] = value
+        entry.update(self.extras.get(i, {}))
+        return entry
+
+
+class KeyIndex:
+    """Every cite key and ids alias in use, for O(1) collision checks.
+
+    Keys handed out by unique() are reserved right away, so a batch of new
+    entries never reuses a key among themselves either.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.duplicates = []
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        index = cls()
+        for i in range(len(corpus)):
+            for key in [corpus.get(i, 'ID')] + entry_aliases(corpus.get(i, 'ids', '')):
+                if key in index.keys:
+                    index.duplicates.append(key)
+                index.keys.add(key)
+        return index
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def reserve(self, key):
+        self.keys.add(key)
+
+    def unique(self, base, own=None):
+        """Reserve and return base, or base with the first free numeric suffix (base2, base3, ...).
+
+        own is a key already held by the entry being keyed, which it may keep.
+        """
+        key = base
+        n = 2
+        while key in self.keys and key != own:
+            key = '%s%d' % (base, n)
+            n += 1
+        self.reserve(key)
+        return key
+
+
+def entry_aliases(ids):
+    return [key.strip() for key in ids.split(',') if key.strip()]
+
+
+def key_files(directory):
+    """Map each cite key to the venue file that defines it"""
+    files = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.bib'))):
+        with open(path) as fp:
+            for key in re.findall(r'^\s*@\w+\s*\{\s*([^,\s]+)\s*,', fp.read(), re.MULTILINE):
+                files.setdefault(key, os.path.basename(path))
+    return files
+
+
+def copy_entry(entry, suffix):
+    """Copy an entry with fresh string objects, like a parser would produce for a new record"""
+    copy = {k: v.encode('utf-8').decode('utf-8') for k, v in entry.items()}
+    copy['ID'] += suffix
+    copy['title'] = entry.get('title', '') + suffix
+    return copy
+
+
+def memory_report(entries, copies):
+    """Measure bytes per entry of the dict representation and of CompactCorpus"""
+    n = len(entries) * copies
+
+    tracemalloc.start()
+    dicts = [copy_entry(e, ' %d' % k) for k in range(copies) for e in entries]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del dicts
+
+    # Each copy is dropped right after it is appended, so only what the corpus retains is counted
+    tracemalloc.start()
+    corpus = CompactCorpus()
+    for k in range(copies):
+        for e in entries:
+            corpus.append(copy_entry(e, ' %d' % k))
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return n, dict_bytes / n, compact_bytes / n
+
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    entries = load_csbib(os.path.dirname(os.path.abspath(__file__)))
+    n, dict_per_entry, compact_per_entry = memory_report(entries, copies)
+    print('%d entries (%d csbib entries x %d)' % (n, len(entries), copies))
+    print('dict representation:    %8.1f bytes/entry' % dict_per_entry)
+    print('compact representation: %8.1f bytes/entry' % compact_per_entry)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import gzip
+import html.entities
+import os
+import re
+import sqlite3
+import sys
+import unicodedata
+import xml.etree.ElementTree as ET
+
+DBLP_DB_NAME = 'dblp.db'
+
+# The store lives next to the csbib files, wherever the importer is run from
+DBLP_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), DBLP_DB_NAME)
+
+# Record types we keep from the dump
+DBLP_RECORD_TYPES = ('article', 'inproceedings')
+
+# Map from dblp key prefix to our venue abbreviation (see KNOWN_VENUES in bib-beautify.py)
+DBLP_VENUES = {
+    'conf/osdi': 'osdi',
+    'conf/sosp': 'sosp',
+    'conf/eurosys': 'eurosys',
+    'conf/usenix': 'atc',
+    'conf/nsdi': 'nsdi',
+    'conf/sigcomm': 'sigcomm',
+    'conf/sigmod': 'sigmod',
+    'conf/vldb': 'vldb',
+    'journals/pvldb': 'vldb',
+    'conf/fast': 'fast',
+    'conf/hotos': 'hotos',
+    'conf/pldi': 'pldi',
+    'conf/popl': 'popl',
+    'conf/oopsla': 'oopsla',
+    'conf/isca': 'isca',
+    'conf/asplos': 'asplos',
+    'conf/cloud': 'socc',
+    'conf/dsn': 'dsn',
+    'conf/cidr': 'cidr',
+    'conf/podc': 'podc',
+    'conf/wdag': 'disc',
+    'conf/spaa': 'spaa',
+    'conf/focs': 'focs',
+    'conf/stoc': 'stoc',
+    'conf/soda': 'soda',
+    'journals/tocs': 'tocs',
+    'journals/tods': 'tods',
+    'journals/tkde': 'tkde',
+    'journals/toplas': 'toplas',
+    'journals/cacm': 'cacm',
+    'journals/jacm': 'jacm',
+    'journals/csur': 'csur',
+}
+
+# dblp appends a 4-digit number to disambiguate homonymous authors, e.g. "Wei Wang 0001"
+AUTHOR_SUFFIX = re.compile(r'\s+\d{4}$')
+
+COMMIT_EVERY = 10000
+
+# Bumped whenever normalize_title changes, so stores keep matching the titles it normalizes
+NORMALIZE_VERSION = '2'
+
+
+# LaTeX commands that stand for letters rather than accents, e.g. {\o} or \ss
+LATEX_LETTERS = {'o': 'o', 'O': 'o', 'l': 'l', 'L': 'l', 'ss': 'ss', 'ae': 'ae', 'AE': 'ae',
+                 'oe': 'oe', 'OE': 'oe', 'aa': 'a', 'AA': 'a', 'i': 'i', 'j': 'j'}
+
+
+def plain_text(text):
+    """Lowercase ASCII text of a LaTeX string, braces and punctuation kept"""
+    # Drop accent commands like \' or \v, keep letter commands like \o as their letters
+    text = re.sub(r'\\([a-zA-Z]+)', lambda m: LATEX_LETTERS.get(m.group(1), ''), text)
+    text = re.sub(r'\\[^a-zA-Z]', '', text)
+    # Strip accents from unicode letters, e.g. á -> a
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def normalize_title(title):
+    """Normalize a title for exact lookups: plain lowercase ASCII, no braces, punctuation or extra spaces.
+
+    LaTeX accents and Unicode ones fold the same way, so Caf{\\'e}, Café and Cafe all match.
+    """
+    title = re.sub(r'[{}]', '', plain_text(title or ''))
+    title = re.sub(r'[^a-z0-9\s]', ' ', title)
+    return ' '.join(title.split())
+
+
+def venue_from_key(key):
+    """Get our venue abbreviation for a dblp key like conf/osdi/CorbettDEFFFGGHHHKKLLMMNQRRSSTWW12"""
+    prefix = '/'.join(key.split('/')[:2])
+    return DBLP_VENUES.get(prefix)
+
+
+def connect_store(db_name=DBLP_STORE):
+    con = sqlite3.connect(db_name)
+    cur = con.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS pubs ('
+                'key TEXT NOT NULL PRIMARY KEY, mdate TEXT NOT NULL, type TEXT NOT NULL, '
+                'title TEXT NOT NULL, norm_title TEXT NOT NULL, authors TEXT NOT NULL, '
+                'container TEXT, venue TEXT, year TEXT, doi TEXT)')
+    cur.execute('CREATE INDEX IF NOT EXISTS pubs_norm_title ON pubs (norm_title)')
+    cur.execute('CREATE INDEX IF NOT EXISTS pubs_doi ON pubs (doi)')
+    cur.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)')
+    cur.execute("SELECT value FROM meta WHERE name = 'normalize_version'")
+    row = cur.fetchone()
+    if not row or row[0] != NORMALIZE_VERSION:
+        # Stores imported with an older normalize_title
+        con.create_function('normalize_title', 1, normalize_title, deterministic=True)
+        cur.execute('UPDATE pubs SET norm_title = normalize_title(title)')
+        cur.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('normalize_version', ?)", (NORMALIZE_VERSION,))
+    con.commit()
+    return con
+
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def parse_record(elem):
+    """Turn a dblp <article>/<inproceedings> element into a row dict, or None if unusable"""
+    key = elem.get('key', '')
+    title_elem = elem.find('title')
+    if not key or title_elem is None:
+        return None
+    # Titles may contain markup like <i> or <sub>, keep the text only
+    title = ' '.join(''.join(title_elem.itertext()).split()).rstrip('.')
+    if not title:
+        return None
+
+    authors = [AUTHOR_SUFFIX.sub('', ''.join(a.itertext()).strip()) for a in elem.findall('author')]
+
+    doi = None
+    for ee in elem.findall('ee'):
+        link = (ee.text or '').strip()
+        if link.startswith('https://doi.org/'):
+            doi = link[16:]
+            break
+
+    return {
+        'key': key,
+        'mdate': elem.get('mdate', ''),
+        'type': elem.tag,
+        'title': title,
+        'norm_title': normalize_title(title),
+        'authors': ' and '.join(authors),
+        'container': elem.findtext('booktitle') or elem.findtext('journal'),
+        'venue': venue_from_key(key),
+        'year': elem.findtext('year'),
+        'doi': doi,
+    }
+
+
+def iter_records(source):
+    """Stream records out of a dblp XML dump in constant memory"""
+    # The dump references named entities from dblp.dtd, which expat does not load
+    parser = ET.XMLParser()
+    parser.entity.update((name, chr(cp)) for name, cp in html.entities.name2codepoint.items())
+
+    context = ET.iterparse(source, events=('start', 'end'), parser=parser)
+    _, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 0:
+            continue
+        # A top-level record is complete
+        if elem.tag in DBLP_RECORD_TYPES:
+            record = parse_record(elem)
+            if record:
+                yield record
+        root.clear()
+
+
+def import_dump(source, db_name=DBLP_STORE):
+    """Import a dblp XML dump (path or binary file object) into the local store.
+
+    Re-importing is incremental: records whose mdate is not newer than the
+    last imported dump are skipped without touching the database.
+    Returns (number of records seen, number of records written).
+    """
+    con = connect_store(db_name)
+    cur = con.cursor()
+    cur.execute("SELECT value FROM meta WHERE name = 'max_mdate'")
+    row = cur.fetchone()
+    last_mdate = row[0] if row else ''
+    max_mdate = last_mdate
+
+    f = open_dump(source) if isinstance(source, str) else source
+
+    seen = 0
+    written = 0
+    try:
+        for record in iter_records(f):
+            seen += 1
+            if record['mdate'] <= last_mdate:
+                continue
+            cur.execute('INSERT INTO pubs (key, mdate, type, title, norm_title, authors, container, venue, year, doi) '
+                        'VALUES (:key, :mdate, :type, :title, :norm_title, :authors, :container, :venue, :year, :doi) '
+                        'ON CONFLICT(key) DO UPDATE SET mdate=excluded.mdate, type=excluded.type, '
+                        'title=excluded.title, norm_title=excluded.norm_title, authors=excluded.authors, '
+                        'container=excluded.container, venue=excluded.venue, year=excluded.year, doi=excluded.doi '
+                        'WHERE excluded.mdate > pubs.mdate', record)
+            written += 1
+            max_mdate = max(max_mdate, record['mdate'])
+            if written % COMMIT_EVERY == 0:
+                con.commit()
+                print('%s records imported...' % written)
+    finally:
+        if f is not source:
+            f.close()
+
+    cur.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('max_mdate', ?)", (max_mdate,))
+    con.commit()
+    con.close()
+    return seen, written
+
+
+def lookup_title(title, venue=None, db_name=DBLP_STORE):
+    """Find a publication in the local store by (normalized) title, optionally restricted to a venue"""
+    norm_title = normalize_title(title)
+    if not norm_title:
+        return None
+    con = connect_store(db_name)
+    con.row_factory = sqlite3.Row
+    cur = con.cursor()
+    if venue:
+        cur.execute('SELECT * FROM pubs WHERE norm_title = ? AND venue = ? ORDER BY year', (norm_title, venue))
+    else:
+        cur.execute('SELECT * FROM pubs WHERE norm_title = ? ORDER BY venue IS NULL, year', (norm_title,))
+    row = cur.fetchone()
+    con.close()
+    return dict(row) if row else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python dblpimport.py <dblp.xml[.gz]> [dblp.db]")
+        print("  The store defaults to dblp.db next to this script, where bib-beautify.py looks for it")
+        print("  Download the dump from https://dblp.org/xml/")
+        sys.exit(1)
+    db_name = sys.argv[2] if len(sys.argv) > 2 else DBLP_STORE
+    seen, written = import_dump(sys.argv[1], db_name)
+    print('%s records in dump, %s new or updated' % (seen, written))
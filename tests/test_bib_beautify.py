@@ -0,0 +1,65 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The script name has a hyphen, so it is loaded from its path
+spec = importlib.util.spec_from_file_location('bib_beautify', os.path.join(ROOT, 'bib-beautify.py'))
+bib_beautify = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bib_beautify)
+
+BIB = """@string{osdi = "Proceedings of the USENIX Symposium on Operating Systems Design and Implementation (OSDI)"}
+@string{sigmod = "Proceedings of the ACM SIGMOD International Conference on Management of Data (SIGMOD)"}
+
+@inproceedings{corbett12spanner,
+ author = {Corbett, James C.},
+ booktitle = osdi,
+ title = {{Spanner}: Google's Globally-Distributed Database},
+ year = {2012}
+}
+
+% Section: Transactions
+%   keep this comment
+
+@inproceedings{thomson12calvin,
+ author = {Thomson, Alexander},
+ booktitle = sigmod,
+ title = {Calvin: Fast Distributed Transactions for Partitioned Database Systems},
+ year = {2012}
+}
+"""
+
+SPANNER = """@inproceedings{corbett12spanner,
+ author = {Corbett, James C.},
+ booktitle = osdi,
+ title = {{Spanner}: Google's Globally-Distributed Database},
+ year = {2012}
+}"""
+
+
+def entries(text):
+    return bib_beautify.bibtexparser.loads(text).entries
+
+
+def test_keep_layout_replaces_only_the_changed_entry(tmp_path):
+    path = tmp_path / 'refs.bib'
+    path.write_text(BIB)
+    spanner, calvin = entries(BIB)
+    spanner['month'] = 'oct'
+
+    assert bib_beautify.write_keeping_layout([spanner, calvin], str(path))
+    assert path.read_text() == BIB.replace(SPANNER, bib_beautify.render_entry(spanner))
+
+    # Nothing changed since
+    assert not bib_beautify.write_keeping_layout([spanner, calvin], str(path))
+
+
+def test_keep_layout_keeps_comments_after_dropped_entries(tmp_path):
+    path = tmp_path / 'refs.bib'
+    path.write_text(BIB)
+    spanner, calvin = entries(BIB)
+
+    assert bib_beautify.write_keeping_layout([calvin], str(path))
+    assert path.read_text() == BIB.replace(SPANNER + '\n\n', '')
@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dblpimport import import_dump, lookup_title, normalize_title
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def test_import_and_lookup(tmp_path):
+    db_name = str(tmp_path / 'dblp.db')
+
+    # The <www> homepage record is skipped
+    assert import_dump(os.path.join(FIXTURES, 'dblp-small.xml'), db_name) == (2, 2)
+
+    pub = lookup_title("Spanner: Google's globally distributed database", 'osdi', db_name)
+    assert pub['key'] == 'conf/osdi/CorbettDEFFFGGHHHKKLLMMNQRRSSTWW12'
+    assert pub['title'] == "Spanner: Google's Globally-Distributed Database"
+    assert pub['authors'] == 'James C. Corbett and Jeffrey Dean and André Fikes'
+    assert pub['venue'] == 'osdi'
+    assert pub['year'] == '2012'
+    assert pub['doi'] == '10.5555/2387880.2387905'
+
+    pub = lookup_title('Fast Widgets for Everyone', None, db_name)
+    assert pub['type'] == 'article'
+    assert pub['venue'] == 'tocs'
+    assert pub['doi'] is None
+
+    assert lookup_title('Fast Widgets for Everyone', 'osdi', db_name) is None
+    assert lookup_title('Home Page', None, db_name) is None
+
+
+def test_reimport_is_incremental(tmp_path):
+    db_name = str(tmp_path / 'dblp.db')
+    import_dump(os.path.join(FIXTURES, 'dblp-small.xml'), db_name)
+
+    # Nothing is newer than what was imported
+    assert import_dump(os.path.join(FIXTURES, 'dblp-small.xml'), db_name) == (2, 0)
+
+    # Only the record with a newer mdate is written
+    assert import_dump(os.path.join(FIXTURES, 'dblp-small-update.xml'), db_name) == (2, 1)
+    assert lookup_title('Fast Widgets for Everyone', None, db_name) is None
+    assert lookup_title('Faster Widgets for Everyone', None, db_name)['mdate'] == '2021-06-01'
+
+
+def test_normalize_title_folds_accents(tmp_path):
+    assert normalize_title('Caf{\\\'e} au Lait for Na{\\"i}ve {S}ystems') == 'cafe au lait for naive systems'
+    assert normalize_title('Café au Lait for Naïve Systems') == 'cafe au lait for naive systems'
+    assert normalize_title('H{\\o}st: {\\AE}gis') == 'host aegis'
+
+    db_name = str(tmp_path / 'dblp.db')
+    import_dump(os.path.join(FIXTURES, 'dblp-small.xml'), db_name)
+    assert lookup_title("Spanner: Google's Globally-Distributed Databas{\\'e}", 'osdi', db_name)['venue'] == 'osdi'